@@ -1,12 +1,18 @@
 # app.py - NYC Crime Data Visualization
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import pydeck as pdk
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 import calendar
+import functools
+import os
+import re
 
 # Page configuration
 st.set_page_config(
@@ -38,135 +44,216 @@ st.markdown('<h1 class="main-header">🗽 NYC Crime Data Analysis Dashboard</h1>
 # Sidebar for controls
 st.sidebar.header("📊 Filter Controls")
 
-@st.cache_data
-def load_data():
-    """Load and preprocess the crime data"""
-    try:
-        # Try to load the arrests.csv file first
-        df = pd.read_csv("arrests.csv")
-        
-        # Data preprocessing
-        df['arrest_date'] = pd.to_datetime(df['arrest_date'])
-        df = df.dropna(subset=['latitude', 'longitude'])
-        df = df[(df['latitude'] != 0) & (df['longitude'] != 0)]
-        
-        # Extract time features
-        df['year'] = df['arrest_date'].dt.year
-        df['month'] = df['arrest_date'].dt.month
-        df['month_name'] = df['arrest_date'].dt.month_name()
-        df['day_of_week'] = df['arrest_date'].dt.day_name()
-        df['hour'] = df['arrest_date'].dt.hour
-        
-        return df
-    except FileNotFoundError:
-        return None
+# Selections above this many arrests are drawn as a hexagon aggregation
+AGGREGATE_THRESHOLD = 20_000
 
-# Load data
-df = load_data()
+# Upper bound on individually drawn points sent to the browser
+MAX_MAP_POINTS = 50_000
 
-if df is None:
-    # Fallback to file uploader if arrests.csv not found
-    st.warning("arrests.csv not found. Please upload a CSV file.")
-    file = st.file_uploader("CSV hochladen", type=["csv"])
-    if not file:
-        st.info("Bitte eine CSV-Datei auswählen.")
-        st.stop()
-    
-    df = pd.read_csv(file)
-    if 'arrest_date' in df.columns:
-        df['arrest_date'] = pd.to_datetime(df['arrest_date'])
-        df = df.dropna(subset=['latitude', 'longitude'])
-        df = df[(df['latitude'] != 0) & (df['longitude'] != 0)]
-        
-        df['year'] = df['arrest_date'].dt.year
-        df['month'] = df['arrest_date'].dt.month
-        df['month_name'] = df['arrest_date'].dt.month_name()
-        df['day_of_week'] = df['arrest_date'].dt.day_name()
-        df['hour'] = df['arrest_date'].dt.hour
+# Deck maps with more points than this are embedded as standalone HTML
+HTML_EMBED_THRESHOLD = 10_000
 
-# Main content
-if df is not None and not df.empty:
-    # Sidebar filters
-    st.sidebar.subheader("🎯 Crime Type Filter")
-    
-    # Define target crime types from your analysis
-    target_crime_types = [
-        "ROBBERY", 
-        "ASSAULT 3 & RELATED OFFENSES", 
-        "OFFENSES AGAINST PUBLIC SAFETY",
-        "KIDNAPPING & RELATED OFFENSES", 
-        "THEFT-FRAUD"
-    ]
-    
-    # Get unique crime types from data
-    all_crime_types = df['ofns_desc'].unique().tolist()
-    all_crime_types.sort()
-    
-    # Filter to show target crimes first, then others
-    available_target_crimes = [crime for crime in target_crime_types if crime in all_crime_types]
-    other_crimes = [crime for crime in all_crime_types if crime not in target_crime_types]
+# Pre-processed Parquet cache of arrests.csv
+CSV_PATH = "arrests.csv"
+PARQUET_PATH = "arrests.parquet"
+PARQUET_COLUMNS = [
+    "arrest_date", "latitude", "longitude", "ofns_desc", "arrest_boro",
+    "arrest_precinct", "year", "month", "month_name", "day_of_week", "hour"
+]
+
+def add_time_features(df):
+    """Parse arrest dates, drop invalid coordinates and extract time features"""
+    df['arrest_date'] = pd.to_datetime(df['arrest_date'])
+    df = df.dropna(subset=['latitude', 'longitude'])
+    df = df[(df['latitude'] != 0) & (df['longitude'] != 0)]
     
-    # Combine with target crimes first
-    crime_types_ordered = available_target_crimes + other_crimes
+    # Extract time features
+    df['year'] = df['arrest_date'].dt.year
+    df['month'] = df['arrest_date'].dt.month
+    df['month_name'] = df['arrest_date'].dt.month_name()
+    df['day_of_week'] = df['arrest_date'].dt.day_name()
+    df['hour'] = df['arrest_date'].dt.hour
     
-    # Multi-select for crime types with target crimes pre-selected
-    selected_crimes = st.sidebar.multiselect(
-        "Select Crime Types:",
-        options=crime_types_ordered,
-        default=available_target_crimes,  # Default to your target crimes
-        help="Select one or more crime types to display. Target crimes from your analysis are pre-selected."
-    )
+    return df
+
+def optimize_dtypes(df):
+    """Store repeated strings as categories and numeric columns in narrow dtypes"""
+    for col in ("ofns_desc", "arrest_boro", "month_name", "day_of_week"):
+        df[col] = df[col].astype("category")
+    df['year'] = df['year'].astype(np.int16)
+    df['month'] = df['month'].astype(np.int8)
+    df['hour'] = df['hour'].astype(np.int8)
+    df['latitude'] = df['latitude'].astype(np.float32)
+    df['longitude'] = df['longitude'].astype(np.float32)
     
-    # Show info about target crimes
-    if available_target_crimes:
-        st.sidebar.info(f"🎯 Your analysis focuses on {len(available_target_crimes)} target crime types (pre-selected above)")
+    return df
+
+def build_cache():
+    """Convert arrests.csv into a compact, pre-processed Parquet file"""
+    df = add_time_features(pd.read_csv(CSV_PATH))
+    # Optional columns such as arrest_precinct may be absent, as in uploads
+    df = optimize_dtypes(df[df.columns.intersection(PARQUET_COLUMNS)].copy())
     
-    # Month slider
-    st.sidebar.subheader("📅 Time Filter")
+    # Write beside the cache and swap it in, so an interrupted write leaves no truncated file
+    tmp_path = f"{PARQUET_PATH}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(tmp_path, compression="zstd")
+        os.replace(tmp_path, PARQUET_PATH)
+    except OSError:
+        # Read-only working directory or full disk: serve the data without caching it
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return df
+
+def cache_is_fresh():
+    """Trust the Parquet cache only if it is at least as new as arrests.csv"""
+    try:
+        parquet_mtime = os.path.getmtime(PARQUET_PATH)
+    except OSError:
+        return False
+    try:
+        return parquet_mtime >= os.path.getmtime(CSV_PATH)
+    except OSError:
+        # No CSV to rebuild from, so the cache is the only source
+        return True
+
+@st.cache_data
+def load_data():
+    """Load the pre-processed crime data, building the Parquet cache when needed"""
+    if cache_is_fresh():
+        try:
+            # The cache holds exactly the PARQUET_COLUMNS that arrests.csv provided
+            return pd.read_parquet(PARQUET_PATH)
+        except (OSError, pa.ArrowException):
+            # Unreadable cache: rebuild it from arrests.csv below
+            pass
     
-    # Get available months
-    available_months = sorted(df['month'].unique())
-    month_names = {i: calendar.month_name[i] for i in available_months}
+    try:
+        # Fall back to arrests.csv and write the cache for the next cold start
+        return build_cache()
+    except FileNotFoundError:
+        return None
+
+# The cached helpers below take the frame unhashed as `_df`; `data_key` identifies
+# the loaded data, since hashing the whole frame costs more than the work it saves
+
+@st.cache_resource
+def build_indices(_df, data_key):
+    """Map each (year, month, borough) to the row positions it covers"""
+    return _df.groupby(["year", "month", "arrest_boro"], sort=False, observed=True).indices
+
+@st.cache_data
+def sidebar_options(_df, data_key):
+    """Collect the values offered by the sidebar filters"""
+    return {
+        "crimes": sorted(_df['ofns_desc'].unique().tolist()),
+        "boroughs": [b for b in _df['arrest_boro'].unique().tolist() if pd.notna(b)],
+        "months": sorted(_df['month'].unique().tolist()),
+        "years": sorted(_df['year'].unique().tolist()),
+    }
+
+@st.cache_resource
+def build_cube(_df, data_key):
+    """Pre-aggregate arrest counts by year, month, borough, crime type and hour"""
+    return _df.groupby(["year", "month", "arrest_boro", "ofns_desc", "hour"], observed=True).size()
+
+def cube_slice(cube, year, month, boroughs, crimes):
+    """Select the cube cells of one month for the chosen boroughs and crime types"""
+    try:
+        cells = cube.xs((year, month), level=("year", "month"))
+    except KeyError:
+        return cube.iloc[:0].droplevel(["year", "month"])
     
-    # Month slider
-    selected_month = st.sidebar.select_slider(
-        "Select Month:",
-        options=available_months,
-        value=available_months[0] if available_months else 1,
-        format_func=lambda x: month_names.get(x, f"Month {x}"),
-        help="Slide to select a specific month"
+    mask = (
+        cells.index.get_level_values("arrest_boro").isin(boroughs) &
+        cells.index.get_level_values("ofns_desc").isin(crimes)
     )
-    
-    # Year filter (if multiple years available)
-    available_years = sorted(df['year'].unique())
-    if len(available_years) > 1:
-        selected_year = st.sidebar.selectbox(
-            "Select Year:",
-            options=available_years,
-            index=len(available_years)-1  # Default to latest year
-        )
+    return cells[mask]
+
+@st.cache_data
+def monthly_trend(_df, data_key, year, crimes, boroughs):
+    """Count arrests per month of a year for the selected crimes and boroughs"""
+    return _df[
+        (_df['year'] == year) &
+        (_df['ofns_desc'].isin(crimes)) &
+        (_df['arrest_boro'].isin(boroughs))
+    ].groupby(['month', 'month_name'], observed=True).size().reset_index(name='arrests')
+
+def show_deck(deck, embed_html):
+    """Render a pydeck map, bypassing st.pydeck_chart for large payloads"""
+    if embed_html:
+        html = deck.to_html(as_string=True)
+        # st.iframe replaces components.html, which newer Streamlit releases deprecate
+        if hasattr(st, "iframe"):
+            st.iframe(html, height=620)
+        else:
+            components.html(html, height=620)
     else:
-        selected_year = available_years[0]
-    
-    # Borough filter
-    st.sidebar.subheader("🏙️ Borough Filter")
-    available_boroughs = df['arrest_boro'].unique().tolist()
-    available_boroughs = [b for b in available_boroughs if pd.notna(b)]
+        st.pydeck_chart(deck, use_container_width=True)
+
+def pick_street_style():
+    """Use the Mapbox street style when a token is configured, else the keyless road style"""
+    if os.environ.get('MAPBOX_API_KEY'):
+        return 'mapbox://styles/mapbox/streets-v12'
+    return 'road'
+
+# Named colours cycled across crime types; color_to_rgb resolves each for pydeck
+STANDARD_COLORS = ['red', 'blue', 'green', 'purple', 'orange', 'brown',
+                   'pink', 'gray', 'olive', 'cyan', 'yellow', 'magenta']
+
+_RGB_RE = re.compile(r'\d+')
+
+# Convert colors to RGB for pydeck
+@functools.lru_cache(maxsize=None)
+def color_to_rgb(color: str) -> tuple[int, int, int]:
+    """Convert various color formats to an RGB tuple"""
+    if isinstance(color, str):
+        if color.startswith('#'):
+            # Hex color
+            hex_color = color.lstrip('#')
+            if len(hex_color) == 6:
+                return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+        elif color.startswith('rgb'):
+            # RGB string format like 'rgb(255, 0, 0)'
+            rgb_values = _RGB_RE.findall(color)
+            if len(rgb_values) >= 3:
+                return tuple(int(rgb_values[i]) for i in range(3))
+        else:
+            # Named colors or other formats - use a color mapping
+            color_dict = {
+                'red': (255, 0, 0), 'blue': (0, 0, 255), 'green': (0, 255, 0),
+                'purple': (128, 0, 128), 'orange': (255, 165, 0), 'brown': (165, 42, 42),
+                'pink': (255, 192, 203), 'gray': (128, 128, 128), 'olive': (128, 128, 0),
+                'cyan': (0, 255, 255), 'yellow': (255, 255, 0), 'magenta': (255, 0, 255)
+            }
+            return color_dict.get(color.lower(), (255, 0, 0))  # Default to red
     
-    selected_boroughs = st.sidebar.multiselect(
-        "Select Boroughs:",
-        options=available_boroughs,
-        default=available_boroughs,
-        help="Select boroughs to display"
-    )
+    # Default fallback
+    return (255, 0, 0)  # Red
+
+for _color in STANDARD_COLORS:
+    color_to_rgb(_color)
+
+@st.fragment
+def render_dashboard(df, data_key, options, selected_crimes, selected_month, selected_year,
+                     selected_boroughs, available_target_crimes):
+    """Render the metrics, map and analytics; map controls rerun only this block"""
+    month_names = {i: calendar.month_name[i] for i in options["months"]}
     
     # Filter data based on selections
-    filtered_df = df[
-        (df['ofns_desc'].isin(selected_crimes)) &
-        (df['month'] == selected_month) &
-        (df['year'] == selected_year) &
-        (df['arrest_boro'].isin(selected_boroughs))
-    ].copy()
+    # Gather the rows of the selected year/month/boroughs from the pre-built index
+    indices = build_indices(df, data_key)
+    index_parts = [
+        indices[(selected_year, selected_month, borough)]
+        for borough in selected_boroughs
+        if (selected_year, selected_month, borough) in indices
+    ]
+    idx = np.concatenate(index_parts) if index_parts else np.empty(0, dtype=np.intp)
+    sub = df.take(idx)
+    filtered_df = sub[sub['ofns_desc'].isin(selected_crimes)]
+    
+    # Chart counts come from the pre-aggregated cube instead of the raw rows
+    cells = cube_slice(build_cube(df, data_key), selected_year, selected_month, selected_boroughs, selected_crimes)
     
     # Main dashboard
     col1, col2, col3, col4 = st.columns(4)
@@ -193,10 +280,12 @@ if df is not None and not df.empty:
         )
     
     with col4:
-        most_common_crime = filtered_df['ofns_desc'].mode()
+        # Sorted counts give the top crime here and feed the pie chart below
+        crime_counts = cells.groupby(level='ofns_desc', observed=True).sum()
+        crime_counts = crime_counts[crime_counts > 0].sort_values(ascending=False)
         st.metric(
             label="Top Crime Type",
-            value=most_common_crime.iloc[0] if not most_common_crime.empty else "N/A",
+            value=crime_counts.index[0] if len(crime_counts) else "N/A",
             delta=None
         )
     
@@ -206,54 +295,17 @@ if df is not None and not df.empty:
     if not filtered_df.empty:
         # Create color mapping for different crime types
         unique_crimes = filtered_df['ofns_desc'].unique()
-        colors = px.colors.qualitative.Set3[:len(unique_crimes)]
-        color_map = dict(zip(unique_crimes, colors))
-        
-        # Convert colors to RGB for pydeck
-        def color_to_rgb(color):
-            """Convert various color formats to RGB list"""
-            if isinstance(color, str):
-                if color.startswith('#'):
-                    # Hex color
-                    hex_color = color.lstrip('#')
-                    if len(hex_color) == 6:
-                        return [int(hex_color[i:i+2], 16) for i in (0, 2, 4)]
-                elif color.startswith('rgb'):
-                    # RGB string format like 'rgb(255, 0, 0)'
-                    import re
-                    rgb_values = re.findall(r'\d+', color)
-                    if len(rgb_values) >= 3:
-                        return [int(rgb_values[i]) for i in range(3)]
-                else:
-                    # Named colors or other formats - use a color mapping
-                    color_dict = {
-                        'red': [255, 0, 0], 'blue': [0, 0, 255], 'green': [0, 255, 0],
-                        'purple': [128, 0, 128], 'orange': [255, 165, 0], 'brown': [165, 42, 42],
-                        'pink': [255, 192, 203], 'gray': [128, 128, 128], 'olive': [128, 128, 0],
-                        'cyan': [0, 255, 255], 'yellow': [255, 255, 0], 'magenta': [255, 0, 255]
-                    }
-                    return color_dict.get(color.lower(), [255, 0, 0])  # Default to red
-            
-            # Default fallback
-            return [255, 0, 0]  # Red
-        
-        # Create better color mapping using standard colors
-        import matplotlib.colors as mcolors
-        
-        # Use matplotlib's standard colors which are more reliable
-        standard_colors = ['red', 'blue', 'green', 'purple', 'orange', 'brown', 
-                          'pink', 'gray', 'olive', 'cyan', 'yellow', 'magenta']
-        
-        # Create color mapping
         color_map = {}
         for i, crime in enumerate(unique_crimes):
-            color_idx = i % len(standard_colors)
-            color_map[crime] = standard_colors[color_idx]
+            color_idx = i % len(STANDARD_COLORS)
+            color_map[crime] = STANDARD_COLORS[color_idx]
         
-        # Add color column
-        filtered_df['color'] = filtered_df['ofns_desc'].map(
-            lambda x: color_to_rgb(color_map.get(x, 'red'))
+        # Add color column: one RGB row per category, gathered by category code
+        rgb_lut = np.array(
+            [color_to_rgb(color_map.get(c, 'red')) for c in filtered_df['ofns_desc'].cat.categories],
+            dtype=np.uint8
         )
+        rgb = rgb_lut[filtered_df['ofns_desc'].cat.codes.to_numpy()]
         
         # NYC coordinates for better view
         nyc_lat = 40.7128
@@ -261,8 +313,9 @@ if df is not None and not df.empty:
         
         # Use NYC center if no data points or fallback to data center
         if len(filtered_df) > 0:
-            center_lat = filtered_df['latitude'].mean()
-            center_lon = filtered_df['longitude'].mean()
+            # Plain floats: NumPy float32 scalars do not serialize to JSON numbers
+            center_lat = float(filtered_df['latitude'].mean())
+            center_lon = float(filtered_df['longitude'].mean())
         else:
             center_lat = nyc_lat
             center_lon = nyc_lon
@@ -276,39 +329,109 @@ if df is not None and not df.empty:
             bearing=0
         )
         
-        layer = pdk.Layer(
-            'ScatterplotLayer',
-            data=filtered_df,
-            get_position='[longitude, latitude]',
-            get_color='color',
-            get_radius=150,
-            radius_scale=8,
-            radius_min_pixels=4,
-            radius_max_pixels=80,
-            pickable=True,
-            auto_highlight=True,
-        )
-        
-        tooltip = {
-            "html": "<b>Crime:</b> {ofns_desc}<br/>"
-                   "<b>Date:</b> {arrest_date}<br/>"
-                   "<b>Borough:</b> {arrest_boro}<br/>"
-                   "<b>Precinct:</b> {arrest_precinct}",
-            "style": {"backgroundColor": "steelblue", "color": "white"}
-        }
-        
         # Option to switch map types first
-        map_type = st.sidebar.radio(
+        map_type = st.radio(
             "🗺️ Map Type:",
             ["Standard Streamlit Map", "Satellite View", "Street Map"],
+            horizontal=True,
             help="Choose your preferred map style"
         )
         
+        aggregate_large = st.checkbox(
+            "Aggregate when large",
+            value=True,
+            help=f"Bin points into hexagons when more than {AGGREGATE_THRESHOLD:,} arrests are selected"
+        )
+        
+        aggregate = (
+            aggregate_large
+            and len(filtered_df) > AGGREGATE_THRESHOLD
+            and map_type != "Standard Streamlit Map"
+        )
+        
+        # Draw at most MAX_MAP_POINTS individual points; analytics keep the full selection
+        if not aggregate and len(filtered_df) > MAX_MAP_POINTS:
+            sample_idx = np.sort(
+                np.random.default_rng(0).choice(len(filtered_df), MAX_MAP_POINTS, replace=False)
+            )
+            viz_df = filtered_df.take(sample_idx)
+            viz_rgb = rgb[sample_idx]
+            st.caption(f"Showing {MAX_MAP_POINTS:,} of {len(filtered_df):,} points on map")
+        else:
+            viz_df = filtered_df
+            viz_rgb = rgb
+        
+        # Large deck maps skip Streamlit's pydeck adapter and lose their tooltips
+        n_points = len(filtered_df) if aggregate else len(viz_df)
+        embed_html = map_type != "Standard Streamlit Map" and n_points > HTML_EMBED_THRESHOLD
+        if embed_html:
+            st.caption(
+                f"Map embedded as static HTML for {n_points:,} points; tooltips are disabled."
+            )
+        show_tooltip = map_type != "Standard Streamlit Map" and not embed_html
+        
+        if aggregate:
+            # Let deck.gl bin the points on the GPU instead of drawing each one
+            layer = pdk.Layer(
+                'HexagonLayer',
+                data=filtered_df[['longitude', 'latitude']],
+                get_position='[longitude, latitude]',
+                radius=100,
+                elevation_scale=4,
+                extruded=False,
+                coverage=1,
+            )
+            tooltip = False
+        else:
+            # Layer payload: a plain frame holding only the fields the layer reads
+            positions = np.ascontiguousarray(viz_df[['longitude', 'latitude']].to_numpy(np.float32))
+            layer_data = {
+                'longitude': positions[:, 0],
+                'latitude': positions[:, 1],
+                'r': viz_rgb[:, 0],
+                'g': viz_rgb[:, 1],
+                'b': viz_rgb[:, 2],
+            }
+            tooltip = False
+            
+            if show_tooltip:
+                # Tooltip fields are only shipped when the tooltip can be shown
+                layer_data.update({
+                    'ofns_desc': viz_df['ofns_desc'].to_numpy(),
+                    'arrest_date': viz_df['arrest_date'].dt.strftime('%Y-%m-%d').to_numpy(),
+                    'arrest_boro': viz_df['arrest_boro'].to_numpy(),
+                    # Uploaded files are not required to carry a precinct column
+                    'arrest_precinct': (
+                        viz_df['arrest_precinct'].to_numpy()
+                        if 'arrest_precinct' in viz_df.columns else 'N/A'
+                    ),
+                })
+                tooltip = {
+                    "html": "<b>Crime:</b> {ofns_desc}<br/>"
+                           "<b>Date:</b> {arrest_date}<br/>"
+                           "<b>Borough:</b> {arrest_boro}<br/>"
+                           "<b>Precinct:</b> {arrest_precinct}",
+                    "style": {"backgroundColor": "steelblue", "color": "white"}
+                }
+            
+            layer = pdk.Layer(
+                'ScatterplotLayer',
+                data=pd.DataFrame(layer_data),
+                get_position='[longitude, latitude]',
+                get_fill_color='[r, g, b]',
+                get_radius=150,
+                radius_scale=8,
+                radius_min_pixels=4,
+                radius_max_pixels=80,
+                pickable=show_tooltip,
+                auto_highlight=show_tooltip,
+            )
+        
         if map_type == "Standard Streamlit Map":
             # Use the reliable Streamlit map
             if not filtered_df.empty:
-                map_data = filtered_df[['latitude', 'longitude']].copy()
-                st.map(map_data, zoom=11, use_container_width=True)
+                # st.map centres on the coordinate mean, which must not be a float32
+                st.map(viz_df[['latitude', 'longitude']].astype('float64'), zoom=11, use_container_width=True)
             else:
                 st.info("Keine Daten für die Kartenanzeige verfügbar.")
                 
@@ -321,104 +444,97 @@ if df is not None and not df.empty:
                 map_style='mapbox://styles/mapbox/satellite-streets-v12'
             )
             try:
-                st.pydeck_chart(r, use_container_width=True)
+                show_deck(r, embed_html)
             except:
                 st.warning("Satellitenkarte nicht verfügbar, zeige Standard-Karte...")
                 if not filtered_df.empty:
-                    map_data = filtered_df[['latitude', 'longitude']].copy()
-                    st.map(map_data, zoom=11, use_container_width=True)
+                    st.map(viz_df[['latitude', 'longitude']].astype('float64'), zoom=11, use_container_width=True)
                     
         else:  # Street Map
-            # Try different street map styles with fallback
-            street_styles = [
-                'mapbox://styles/mapbox/streets-v12',
-                'mapbox://styles/mapbox/streets-v11',
-                'mapbox://styles/mapbox/light-v11',
-                'road'
-            ]
-            
-            map_displayed = False
-            for style in street_styles:
-                try:
-                    r = pdk.Deck(
-                        layers=[layer],
-                        initial_view_state=view_state,
-                        tooltip=tooltip,
-                        map_style=style
-                    )
-                    st.pydeck_chart(r, use_container_width=True)
-                    map_displayed = True
-                    break
-                except:
-                    continue
+            # Street style is chosen once per session instead of probed on every rerun
+            if 'street_style' not in st.session_state:
+                st.session_state.street_style = pick_street_style()
             
-            if not map_displayed:
+            r = pdk.Deck(
+                layers=[layer],
+                initial_view_state=view_state,
+                tooltip=tooltip,
+                map_style=st.session_state.street_style
+            )
+            try:
+                show_deck(r, embed_html)
+            except:
                 st.warning("3D-Karte nicht verfügbar, zeige Standard-Karte...")
                 if not filtered_df.empty:
-                    map_data = filtered_df[['latitude', 'longitude']].copy()
-                    st.map(map_data, zoom=11, use_container_width=True)
+                    st.map(viz_df[['latitude', 'longitude']].astype('float64'), zoom=11, use_container_width=True)
         
         # Legend
         st.subheader("🎨 Crime Type Legend")
-        legend_cols = st.columns(min(len(unique_crimes), 4))
-        for i, crime in enumerate(unique_crimes):
-            with legend_cols[i % 4]:
-                color_name = color_map[crime]
-                st.markdown(
-                    f'<div style="display: flex; align-items: center; margin: 5px 0;">'
-                    f'<div style="width: 20px; height: 20px; background-color: {color_name}; '
-                    f'border-radius: 50%; margin-right: 10px;"></div>'
-                    f'<span style="font-size: 12px;">{crime}</span></div>',
-                    unsafe_allow_html=True
-                )
+        legend_html = (
+            '<div style="display: grid; grid-template-columns: repeat(4, 1fr); gap: 6px;">'
+            + "".join(
+                f'<div style="display: flex; align-items: center; margin: 5px 0;">'
+                f'<div style="width: 20px; height: 20px; background-color: {color_map[crime]}; '
+                f'border-radius: 50%; margin-right: 10px;"></div>'
+                f'<span style="font-size: 12px;">{crime}</span></div>'
+                for crime in unique_crimes
+            )
+            + '</div>'
+        )
+        st.markdown(legend_html, unsafe_allow_html=True)
         
-        # Additional analytics
-        st.subheader("📈 Crime Analytics")
+        # Additional analytics, only built while the panel is switched on
+        if st.toggle("📈 Show Crime Analytics", key="analytics_open"):
+            st.subheader("📈 Crime Analytics")
         
-        col1, col2 = st.columns(2)
+            col1, col2 = st.columns(2)
         
-        with col1:
-            # Crime distribution pie chart
-            crime_counts = filtered_df['ofns_desc'].value_counts()
-            fig_pie = px.pie(
-                values=crime_counts.values,
-                names=crime_counts.index,
-                title=f"Crime Distribution - {month_names.get(selected_month)} {selected_year}"
-            )
-            st.plotly_chart(fig_pie, use_container_width=True)
+            with col1:
+                # Crime distribution pie chart
+                fig_pie = go.Figure(go.Pie(
+                    labels=crime_counts.index.to_numpy(),
+                    values=crime_counts.to_numpy()
+                ))
+                fig_pie.update_layout(
+                    title=f"Crime Distribution - {month_names.get(selected_month)} {selected_year}"
+                )
+                st.plotly_chart(fig_pie, use_container_width=True)
         
-        with col2:
-            # Hourly distribution
-            hourly_counts = filtered_df['hour'].value_counts().sort_index()
-            fig_bar = px.bar(
-                x=hourly_counts.index,
-                y=hourly_counts.values,
-                title="Arrests by Hour of Day",
-                labels={'x': 'Hour', 'y': 'Number of Arrests'}
-            )
-            st.plotly_chart(fig_bar, use_container_width=True)
+            with col2:
+                # Hourly distribution
+                hourly_counts = cells.groupby(level='hour').sum().reindex(range(24), fill_value=0).to_numpy()
+                fig_bar = go.Figure(go.Bar(x=np.arange(len(hourly_counts)), y=hourly_counts))
+                fig_bar.update_layout(
+                    title="Arrests by Hour of Day",
+                    xaxis_title="Hour",
+                    yaxis_title="Number of Arrests"
+                )
+                st.plotly_chart(fig_bar, use_container_width=True)
         
-        # Borough analysis
-        if len(selected_boroughs) > 1:
-            st.subheader("🏙️ Borough Comparison")
-            borough_counts = filtered_df['arrest_boro'].value_counts()
-            fig_borough = px.bar(
-                x=borough_counts.values,
-                y=borough_counts.index,
-                orientation='h',
-                title="Arrests by Borough",
-                labels={'x': 'Number of Arrests', 'y': 'Borough'}
-            )
-            st.plotly_chart(fig_borough, use_container_width=True)
+            # Borough analysis
+            if len(selected_boroughs) > 1:
+                st.subheader("🏙️ Borough Comparison")
+                borough_counts = cells.groupby(level='arrest_boro', observed=True).sum()
+                borough_counts = borough_counts[borough_counts > 0].sort_values(ascending=False)
+                fig_borough = px.bar(
+                    x=borough_counts.values,
+                    y=borough_counts.index,
+                    orientation='h',
+                    title="Arrests by Borough",
+                    labels={'x': 'Number of Arrests', 'y': 'Borough'}
+                )
+                st.plotly_chart(fig_borough, use_container_width=True)
         
         # Time series for comparison
         if st.checkbox("Show Monthly Trend Comparison"):
             st.subheader("📊 Monthly Trend Analysis")
-            monthly_data = df[
-                (df['ofns_desc'].isin(selected_crimes)) &
-                (df['year'] == selected_year) &
-                (df['arrest_boro'].isin(selected_boroughs))
-            ].groupby(['month', 'month_name']).size().reset_index(name='arrests')
+            monthly_data = monthly_trend(
+                df,
+                data_key,
+                int(selected_year),
+                tuple(sorted(selected_crimes)),
+                tuple(sorted(selected_boroughs))
+            )
             
             fig_trend = px.line(
                 monthly_data,
@@ -446,13 +562,131 @@ if df is not None and not df.empty:
         st.write(f"**Total records in dataset:** {len(df):,}")
         st.write(f"**Filtered records:** {len(filtered_df):,}")
         st.write(f"**Date range:** {df['arrest_date'].min().strftime('%Y-%m-%d')} to {df['arrest_date'].max().strftime('%Y-%m-%d')}")
-        st.write(f"**Available crime types:** {len(all_crime_types)}")
+        st.write(f"**Available crime types:** {len(options['crimes'])}")
         st.write(f"**Target crime types from analysis:** {len(available_target_crimes)}")
-        st.write(f"**Available boroughs:** {len(available_boroughs)}")
+        st.write(f"**Available boroughs:** {len(options['boroughs'])}")
         
         if st.checkbox("Show sample data"):
             st.dataframe(filtered_df.head(100))
 
+# Load data
+df = load_data()
+data_key = (PARQUET_PATH, len(df)) if df is not None else None
+
+if df is None:
+    # Fallback to file uploader if arrests.csv not found
+    st.warning("arrests.csv not found. Please upload a CSV file.")
+    file = st.file_uploader("CSV hochladen", type=["csv"])
+    if not file:
+        st.info("Bitte eine CSV-Datei auswählen.")
+        st.stop()
+    
+    # Arrow's multi-threaded reader dictionary-encodes strings; arrest_date stays
+    # a string so add_time_features can parse any format pd.to_datetime accepts
+    try:
+        df = pacsv.read_csv(
+            file,
+            convert_options=pacsv.ConvertOptions(
+                column_types={
+                    'arrest_date': pa.string(),
+                    'latitude': pa.float32(),
+                    'longitude': pa.float32(),
+                    'ofns_desc': pa.dictionary(pa.int32(), pa.string()),
+                    'arrest_boro': pa.dictionary(pa.int32(), pa.string()),
+                }
+            )
+        ).to_pandas()
+    except pa.ArrowInvalid:
+        # Values Arrow cannot convert: fall back to the pandas parser
+        file.seek(0)
+        df = pd.read_csv(file)
+        for col in ('latitude', 'longitude'):
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+    if 'arrest_date' in df.columns:
+        df = optimize_dtypes(add_time_features(df))
+    data_key = (file.file_id, len(df))
+
+# Main content
+if df is not None and not df.empty:
+    # Sidebar filters
+    st.sidebar.subheader("🎯 Crime Type Filter")
+    
+    # Define target crime types from your analysis
+    target_crime_types = [
+        "ROBBERY", 
+        "ASSAULT 3 & RELATED OFFENSES", 
+        "OFFENSES AGAINST PUBLIC SAFETY",
+        "KIDNAPPING & RELATED OFFENSES", 
+        "THEFT-FRAUD"
+    ]
+    
+    # Get unique crime types from data
+    options = sidebar_options(df, data_key)
+    all_crime_types = options["crimes"]
+    
+    # Filter to show target crimes first, then others
+    available_target_crimes = [crime for crime in target_crime_types if crime in all_crime_types]
+    other_crimes = [crime for crime in all_crime_types if crime not in target_crime_types]
+    
+    # Combine with target crimes first
+    crime_types_ordered = available_target_crimes + other_crimes
+    
+    # Multi-select for crime types with target crimes pre-selected
+    selected_crimes = st.sidebar.multiselect(
+        "Select Crime Types:",
+        options=crime_types_ordered,
+        default=available_target_crimes,  # Default to your target crimes
+        help="Select one or more crime types to display. Target crimes from your analysis are pre-selected."
+    )
+    
+    # Show info about target crimes
+    if available_target_crimes:
+        st.sidebar.info(f"🎯 Your analysis focuses on {len(available_target_crimes)} target crime types (pre-selected above)")
+    
+    # Month slider
+    st.sidebar.subheader("📅 Time Filter")
+    
+    # Get available months
+    available_months = options["months"]
+    month_names = {i: calendar.month_name[i] for i in available_months}
+    
+    # Month slider
+    selected_month = st.sidebar.select_slider(
+        "Select Month:",
+        options=available_months,
+        value=available_months[0] if available_months else 1,
+        format_func=lambda x: month_names.get(x, f"Month {x}"),
+        help="Slide to select a specific month"
+    )
+    
+    # Year filter (if multiple years available)
+    available_years = options["years"]
+    if len(available_years) > 1:
+        selected_year = st.sidebar.selectbox(
+            "Select Year:",
+            options=available_years,
+            index=len(available_years)-1  # Default to latest year
+        )
+    else:
+        selected_year = available_years[0]
+    
+    # Borough filter
+    st.sidebar.subheader("🏙️ Borough Filter")
+    available_boroughs = options["boroughs"]
+    
+    selected_boroughs = st.sidebar.multiselect(
+        "Select Boroughs:",
+        options=available_boroughs,
+        default=available_boroughs,
+        help="Select boroughs to display"
+    )
+    
+    render_dashboard(
+        df, data_key, options, selected_crimes, selected_month, selected_year,
+        selected_boroughs, available_target_crimes
+    )
+
 else:
     st.error("No data available. Please check your CSV file.")
     st.info("Expected columns: arrest_date, latitude, longitude, ofns_desc, arrest_boro")